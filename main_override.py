@@ -3,18 +3,34 @@ Minimal but functional FastAPI backend for Plinth app
 Single-file implementation with SQLite, JWT, and mock data
 """
 
+import base64
 import os
+import random
+import re
 import sqlite3
 import json
 import hashlib
+import hmac
 import secrets
-from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict, Any, List
-from uuid import uuid4
-
-from fastapi import FastAPI, HTTPException, Depends, status, Header
-from fastapi.middleware.cors import CORSMiddleware
+import threading
+import time
+from functools import lru_cache
+from itertools import islice
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Callable, List, Iterable, Iterator
+from uuid import UUID, uuid4
+
+import orjson
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Depends, status, Header, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
+from typing_extensions import TypedDict
 from jose import JWTError, jwt
 import uvicorn
 
@@ -27,89 +43,215 @@ JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRY_HOURS = 24
 REFRESH_TOKEN_EXPIRY_DAYS = 7
+TOKEN_CACHE_TTL_SECONDS = 3600
+ONBOARDING_CACHE_TTL_SECONDS = 60
+MAX_REQUEST_BODY_BYTES = 1024 * 1024
+CHAT_MESSAGE_MAX_LENGTH = 2000
 
-CORS_ORIGINS = os.getenv("CORS_ORIGINS", "").split(",") if os.getenv("CORS_ORIGINS") else []
-DEFAULT_CORS_ORIGINS = [
+DEFAULT_CORS_ORIGINS = frozenset({
     "http://localhost:5173",
     "http://localhost:3000",
     "http://localhost:8080",
     "https://project-haven-pi.vercel.app",
-]
-CORS_ORIGINS = [o.strip() for o in CORS_ORIGINS if o.strip()] or DEFAULT_CORS_ORIGINS
+})
+# CORS_ORIGINS (comma-separated) replaces the defaults when set
+CORS_ORIGINS = frozenset(
+    o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()
+) or DEFAULT_CORS_ORIGINS
+
+# ============================================================================
+# Time Utilities
+# ============================================================================
+
+BRIEF_EXPIRY_SECONDS = 7 * 24 * 3600
+
+@lru_cache(maxsize=8)
+def _iso_at(epoch_second: int) -> str:
+    """Format a UTC epoch second as ISO-8601 (cached, so once per second)"""
+    return datetime.fromtimestamp(epoch_second, timezone.utc).isoformat()
+
+def utc_now_iso(offset_seconds: int = 0) -> str:
+    """Current UTC time (plus an optional offset) at second resolution"""
+    return _iso_at(int(time.time()) + offset_seconds)
+
+def utc_today_iso() -> str:
+    """Current UTC date as YYYY-MM-DD"""
+    return utc_now_iso()[:10]
 
 # ============================================================================
 # Database Setup
 # ============================================================================
 
 DB_PATH = "/tmp/plinth_users.db"
+SCHEMA_VERSION = 1
+
+# One long-lived connection per worker process, shared by all threadpool
+# workers; sqlite3 objects are not safe for concurrent use, so every access
+# goes through _DB_LOCK. Opened by init_db() from the app lifespan.
+_CONN: Optional[sqlite3.Connection] = None
+_DB_LOCK = threading.Lock()
+
+# Hot-path statements, kept byte-identical so sqlite3's per-connection
+# statement cache reuses the prepared form on every call
+_SQL_SELECT_USER_ID_BY_EMAIL = "SELECT user_id FROM users WHERE email = ?"
+_SQL_SELECT_USER_BY_EMAIL = "SELECT user_id, password_hash FROM users WHERE email = ?"
+_SQL_INSERT_USER = (
+    "INSERT INTO users (user_id, email, password_hash, created_at, onboarding_flags) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+_SQL_SELECT_ONBOARDING = "SELECT onboarding_data FROM users WHERE user_id = ?"
+_SQL_SELECT_ME = (
+    "SELECT user_id, email, created_at, onboarding_data IS NOT NULL AS has_ob "
+    "FROM users WHERE user_id = ?"
+)
+_SQL_SELECT_ME_WITH_ONBOARDING = (
+    "SELECT user_id, email, created_at, onboarding_data IS NOT NULL AS has_ob, onboarding_data "
+    "FROM users WHERE user_id = ?"
+)
+
+# onboarding_flags column values, serialized once
+_DEFAULT_ONBOARDING_FLAGS_JSON = json.dumps({
+    "completed_questionnaire": False,
+    "selected_tone": False,
+    "reviewed_brief": False,
+})
+_COMPLETED_ONBOARDING_FLAGS_JSON = json.dumps({
+    "completed_questionnaire": True,
+    "selected_tone": True,
+    "reviewed_brief": False,
+})
 
 def init_db():
-    """Initialize SQLite database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            onboarding_flags TEXT,
-            questionnaire_data TEXT,
-            tone_data TEXT,
-            onboarding_data TEXT
-        )
-    """)
-    # Add onboarding_data column if it doesn't exist (migration)
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN onboarding_data TEXT")
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    conn.commit()
-    conn.close()
-
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_PATH)
+    """Open the shared connection and initialize the SQLite database"""
+    global _CONN
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
     conn.row_factory = sqlite3.Row
-    return conn
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size = -20000")  # ~20MB page cache
+    with _DB_LOCK:
+        _CONN = conn
+
+    with get_db() as db:
+        if db.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        # IMMEDIATE so concurrently starting workers migrate one at a time
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id TEXT PRIMARY KEY,
+                    email TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    onboarding_flags TEXT,
+                    questionnaire_data TEXT,
+                    tone_data TEXT,
+                    onboarding_data TEXT
+                )
+            """)
+            # Add onboarding_data column to pre-v1 tables (migration)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(users)")}
+            if "onboarding_data" not in columns:
+                db.execute("ALTER TABLE users ADD COLUMN onboarding_data TEXT")
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+def close_db():
+    """Close the shared connection"""
+    global _CONN
+    with _DB_LOCK:
+        if _CONN is not None:
+            _CONN.close()
+            _CONN = None
+
+@contextmanager
+def get_db() -> Iterator[sqlite3.Connection]:
+    """Hold the shared database connection (autocommit) for the block"""
+    with _DB_LOCK:
+        yield _CONN
 
 # ============================================================================
 # Password & JWT Utilities
 # ============================================================================
 
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+# Each derivation needs ~16 MiB (128 * n * r); cap concurrent ones per worker
+# so a burst of logins/sign-ups can't exhaust memory via the 40-thread pool
+SCRYPT_MAX_CONCURRENCY = 4
+_SCRYPT_SLOTS = threading.BoundedSemaphore(SCRYPT_MAX_CONCURRENCY)
+
+def _prehash(password: str) -> str:
+    """SHA-256 of the password; the KDF input and the verify-cache key"""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def _scrypt(prehash: str, salt: bytes) -> str:
+    """Derive the hex scrypt key for a prehashed password"""
+    with _SCRYPT_SLOTS:
+        return hashlib.scrypt(prehash.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32).hex()
+
 def hash_password(password: str) -> str:
-    """Hash password with SHA-256 + random salt"""
-    salt = secrets.token_hex(16)
-    h = hashlib.sha256((salt + password).encode()).hexdigest()
-    return f"{salt}${h}"
+    """Hash password with scrypt over its SHA-256 prehash"""
+    salt = secrets.token_bytes(16)
+    return f"scrypt${salt.hex()}${_scrypt(_prehash(password), salt)}"
+
+@lru_cache(maxsize=4096)
+def _verify_scrypt_cached(hashed: str, prehash: str) -> bool:
+    """Verify an scrypt hash; memoized on (stored hash, prehash), never the raw password"""
+    _, salt, h = hashed.split("$", 2)
+    return hmac.compare_digest(_scrypt(prehash, bytes.fromhex(salt)), h)
 
 def verify_password(plain: str, hashed: str) -> bool:
-    """Verify password against stored hash"""
+    """Verify password against stored hash (scrypt, or legacy BLAKE2b/SHA-256)"""
     try:
-        salt, h = hashed.split("$", 1)
-        return hashlib.sha256((salt + plain).encode()).hexdigest() == h
+        if hashed.startswith("scrypt$"):
+            return _verify_scrypt_cached(hashed, _prehash(plain))
+        if hashed.startswith("b2$"):
+            _, salt, h = hashed.split("$", 2)
+            candidate = hashlib.blake2b(plain.encode(), salt=bytes.fromhex(salt), digest_size=32).hexdigest()
+        else:
+            salt, h = hashed.split("$", 1)
+            candidate = hashlib.sha256((salt + plain).encode()).hexdigest()
+        return hmac.compare_digest(candidate, h)
     except (ValueError, AttributeError):
         return False
 
+def _b64url(raw: bytes) -> bytes:
+    """Unpadded base64url, as used by JWT"""
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
+
+# HS256 signing state reused by every encode: the header segment never
+# changes, and copying a keyed HMAC skips re-deriving the inner/outer pads
+_JWT_HEADER_B64 = _b64url(orjson.dumps({"alg": JWT_ALGORITHM, "typ": "JWT"}))
+_JWT_HMAC = hmac.new(JWT_SECRET.encode(), digestmod=hashlib.sha256)
+
+def _encode_jwt(payload: Dict[str, Any]) -> str:
+    """Sign an HS256 JWT (decoded by jose in verify_token)"""
+    signing_input = _JWT_HEADER_B64 + b"." + _b64url(orjson.dumps(payload))
+    mac = _JWT_HMAC.copy()
+    mac.update(signing_input)
+    return (signing_input + b"." + _b64url(mac.digest())).decode()
+
 def create_tokens(user_id: str) -> Dict[str, str]:
     """Create access and refresh tokens"""
-    now = datetime.now(timezone.utc)
+    now = int(time.time())
 
-    access_payload = {
+    access_token = _encode_jwt({
         "sub": user_id,
-        "exp": now + timedelta(hours=JWT_EXPIRY_HOURS),
+        "exp": now + JWT_EXPIRY_HOURS * 3600,
         "iat": now,
         "type": "access",
-    }
-    access_token = jwt.encode(access_payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    })
 
-    refresh_payload = {
+    refresh_token = _encode_jwt({
         "sub": user_id,
-        "exp": now + timedelta(days=REFRESH_TOKEN_EXPIRY_DAYS),
+        "exp": now + REFRESH_TOKEN_EXPIRY_DAYS * 86400,
         "iat": now,
         "type": "refresh",
-    }
-    refresh_token = jwt.encode(refresh_payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    })
 
     return {
         "access_token": access_token,
@@ -118,161 +260,500 @@ def create_tokens(user_id: str) -> Dict[str, str]:
         "user_id": user_id,
     }
 
+# token -> (user_id, exp); entries never outlive the token's own expiry
+_TOKEN_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL_SECONDS)
+_TOKEN_CACHE_LOCK = threading.Lock()
+
 def verify_token(token: str) -> str:
     """Verify token and return user_id"""
+    with _TOKEN_CACHE_LOCK:
+        cached = _TOKEN_CACHE.get(token)
+    if cached and cached[1] > time.time():
+        return cached[0]
+
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         user_id = payload.get("sub")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
-        return user_id
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-def get_current_user(authorization: Optional[str] = Header(None)) -> str:
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[token] = (user_id, payload.get("exp", 0))
+    return user_id
+
+async def get_current_user(authorization: Optional[str] = Header(None)) -> str:
     """Extract user_id from Authorization header"""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing authorization")
     token = authorization.split(" ", 1)[1]
     return verify_token(token)
 
+# Any integer outside orjson's 64-bit range has at least 19 digits
+_LONG_DIGITS_RE = re.compile(rb"\d{19}")
+
+# Routes taking orjson_body have no Body() parameter, so their (optional JSON
+# object) request body is declared for the OpenAPI schema via openapi_extra
+OPTIONAL_OBJECT_BODY_OPENAPI = {
+    "requestBody": {
+        "content": {
+            "application/json": {
+                "schema": {
+                    "anyOf": [{"type": "object", "additionalProperties": True}, {"type": "null"}],
+                    "title": "Data",
+                },
+            },
+        },
+    },
+}
+
+async def orjson_body(request: Request) -> Optional[Dict[str, Any]]:
+    """Parse an optional JSON object request body with orjson.
+
+    orjson reads integers beyond 64 bits as (rounded) floats, so bodies that
+    may contain one are re-parsed with json to keep them exact. Anything orjson
+    rejects is retried with json, which FastAPI's own body parsing uses, so
+    accepted input and 422 errors keep FastAPI's validation-error shape.
+    """
+    body = await request.body()
+    if not body:
+        return None
+    try:
+        data = orjson.loads(body)
+        if _LONG_DIGITS_RE.search(body):
+            data = json.loads(body)
+    except orjson.JSONDecodeError:
+        try:
+            data = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise RequestValidationError(
+                [{
+                    "type": "json_invalid",
+                    "loc": ("body", e.pos),
+                    "msg": "JSON decode error",
+                    "input": {},
+                    "ctx": {"error": e.msg},
+                }],
+                body=e.doc,
+            )
+        except ValueError:
+            # Not decodable as UTF-8/16/32; same answer as FastAPI's body parsing
+            raise HTTPException(status_code=400, detail="There was an error parsing the body")
+    if data is not None and not isinstance(data, dict):
+        raise RequestValidationError(
+            [{"type": "dict_type", "loc": ("body",), "msg": "Input should be a valid dictionary", "input": data}],
+            body=data,
+        )
+    return data
+
+# user_id -> (parsed onboarding dict, {kind: text rendered from it}). Only
+# onboarded users are cached, so a user who just completed onboarding is never
+# served a stale "not onboarded" result by another worker; complete_onboarding
+# invalidates the entry. Rendered texts live in the entry so they expire and
+# are invalidated together with the data they came from.
+_ONBOARDING_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=ONBOARDING_CACHE_TTL_SECONDS)
+_ONBOARDING_CACHE_LOCK = threading.Lock()
+
 def get_user_onboarding(user_id: str) -> Optional[Dict[str, Any]]:
     """Get user's onboarding data if it exists"""
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT onboarding_data FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    db.close()
-    if row and row["onboarding_data"]:
-        try:
-            return json.loads(row["onboarding_data"])
-        except (json.JSONDecodeError, TypeError):
-            return None
-    return None
+    with _ONBOARDING_CACHE_LOCK:
+        entry = _ONBOARDING_CACHE.get(user_id)
+    if entry is not None:
+        return entry[0]
+
+    with get_db() as db:
+        row = db.execute(_SQL_SELECT_ONBOARDING, (user_id,)).fetchone()
+    if not row or not row["onboarding_data"]:
+        return None
+    try:
+        ob = json.loads(row["onboarding_data"])
+    except (json.JSONDecodeError, TypeError):
+        return None
+
+    with _ONBOARDING_CACHE_LOCK:
+        _ONBOARDING_CACHE[user_id] = (ob, {})
+    return ob
+
+async def load_user_onboarding(user_id: str) -> Optional[Dict[str, Any]]:
+    """Get onboarding data from an async handler.
+
+    Cache hits return on the event loop; misses run the SQLite lookup in the
+    threadpool so the loop never blocks on the database.
+    """
+    with _ONBOARDING_CACHE_LOCK:
+        entry = _ONBOARDING_CACHE.get(user_id)
+    if entry is not None:
+        return entry[0]
+    return await run_in_threadpool(get_user_onboarding, user_id)
+
+def cached_render(user_id: str, ob: Dict[str, Any], kind: str, render: Callable[[], str]) -> str:
+    """Return the text for kind rendered from ob, cached in ob's cache entry.
+
+    The text is only cached while the user's entry still holds this exact ob,
+    so a render racing an invalidation never outlives the data it came from.
+    """
+    with _ONBOARDING_CACHE_LOCK:
+        entry = _ONBOARDING_CACHE.get(user_id)
+    if entry is None or entry[0] is not ob:
+        return render()
+    text = entry[1].get(kind)
+    if text is None:
+        text = entry[1][kind] = render()
+    return text
+
+def invalidate_user_onboarding(user_id: str):
+    """Drop a user's cached onboarding data (and texts rendered from it) after it changes"""
+    with _ONBOARDING_CACHE_LOCK:
+        _ONBOARDING_CACHE.pop(user_id, None)
 
 # ============================================================================
-# Pydantic Models
+# Request Models & Response Envelopes
 # ============================================================================
 
 class AuthRequest(BaseModel):
     email: str
     password: str
 
-class AuthResponse(BaseModel):
-    ok: bool
-    data: Dict[str, Any]
-    meta: Dict[str, str] = Field(default_factory=lambda: {"trace_id": str(uuid4())})
-
 class RefreshTokenRequest(BaseModel):
     refresh_token: str
 
-class SessionResponse(BaseModel):
+class ChatRequest(BaseModel):
+    message: str = Field(max_length=CHAT_MESSAGE_MAX_LENGTH)
+    context: Optional[Dict[str, Any]] = None
+
+class QuestionnaireRequest(BaseModel):
+    topics: List[str] = []
+    positioning: str = ""
+
+class ToneRequest(BaseModel):
+    tone_markers: List[str] = []
+    boundaries: List[str] = []
+
+# Response envelopes are built by envelope(); the TypedDicts only describe
+# their shape for the OpenAPI schema, so no model is instantiated per response.
+
+class AuthResponse(TypedDict):
     ok: bool
     data: Dict[str, Any]
-    meta: Dict[str, str] = Field(default_factory=lambda: {"trace_id": str(uuid4())})
+    meta: Dict[str, str]
 
-class DataEnvelopeResponse(BaseModel):
+class SessionResponse(TypedDict):
     ok: bool
-    data: Dict[str, Any] = Field(default_factory=dict)
-    meta: Dict[str, str] = Field(default_factory=lambda: {"trace_id": str(uuid4())})
+    data: Dict[str, Any]
+    meta: Dict[str, str]
 
-class ChatRequest(BaseModel):
-    message: str
-    context: Optional[Dict[str, Any]] = None
+class DataEnvelopeResponse(TypedDict):
+    ok: bool
+    data: Dict[str, Any]
+    meta: Dict[str, str]
+
+def dumps_json(content: Any) -> bytes:
+    """Encode with orjson, matching stdlib json for client-supplied data.
+
+    Non-str keys (e.g. numeric territories used as dict keys) are stringified,
+    and integers wider than 64 bits, which orjson refuses, go through json.
+    """
+    try:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+# Generator for non-security ids (trace/draft/questionnaire ids); salts, tokens
+# and user ids keep using the OS CSPRNG. Reseeded in forked workers.
+_ID_RNG = random.Random(os.urandom(32))
+os.register_at_fork(after_in_child=lambda: _ID_RNG.seed(os.urandom(32)))
+
+def new_id() -> str:
+    """Random UUID4-formatted string for non-security identifiers"""
+    return str(UUID(int=_ID_RNG.getrandbits(128), version=4))
+
+# Trace id supplied by the client for the current request (see TraceIdMiddleware)
+_REQUEST_TRACE_ID: ContextVar[Optional[str]] = ContextVar("request_trace_id", default=None)
+
+def new_trace_id() -> str:
+    """Response trace id: the client's X-Trace-Id if sent, else 32 random hex chars"""
+    return _REQUEST_TRACE_ID.get() or format(_ID_RNG.getrandbits(128), "032x")
+
+def envelope(data: Dict[str, Any]) -> Response:
+    """Return data in the standard success envelope, already rendered.
+
+    Handlers return the Response itself so FastAPI skips response-model
+    validation and jsonable_encoder; response_model is kept on the route
+    decorators for the OpenAPI schema only.
+    """
+    return FastJSONResponse({"ok": True, "data": data, "meta": {"trace_id": new_trace_id()}})
+
+def raw_envelope(data_json: bytes) -> Response:
+    """Return the success envelope around already-encoded data"""
+    return Response(
+        content=b'{"ok":true,"data":' + data_json + b',"meta":{"trace_id":"' + new_trace_id().encode() + b'"}}',
+        media_type="application/json",
+    )
+
+def with_fields(data_json: bytes, **fields: Any) -> bytes:
+    """Splice extra fields into an encoded, non-empty JSON object"""
+    return data_json[:-1] + b"," + dumps_json(fields)[1:]
+
+def fill_template(template: bytes, *values: Any) -> bytes:
+    """Fill a JSON template's %b slots, encoding each value with dumps_json"""
+    return template % tuple(dumps_json(v) for v in values)
+
+def etag_for(data_json: bytes) -> str:
+    """Weak ETag for encoded envelope data (meta.trace_id varies per response)"""
+    return 'W/"' + hashlib.blake2b(data_json, digest_size=8).hexdigest() + '"'
+
+def conditional_envelope(request: Request, data_json: bytes, etag: str) -> Response:
+    """Envelope data_json, or answer 304 if the client already holds etag.
+
+    Bodies are per-user, so caches are told to key on the Authorization header,
+    and must revalidate every use so onboarding changes show up immediately.
+    """
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tag = etag[2:]
+        if if_none_match.strip() == "*" or any(
+            t.strip().removeprefix("W/") == tag for t in if_none_match.split(",")
+        ):
+            return Response(status_code=304, headers=headers)
+    response = raw_envelope(data_json)
+    response.headers.update(headers)
+    return response
 
 # ============================================================================
-# App Setup
+# Middleware
 # ============================================================================
 
-app = FastAPI(title="Plinth Backend", version="1.1.0")
+# Incoming trace ids are spliced into raw JSON bytes, so only plain tokens pass
+_TRACE_ID_RE = re.compile(rb"[A-Za-z0-9_.-]{1,64}")
+
+class TraceIdMiddleware:
+    """Pure-ASGI middleware exposing a valid X-Trace-Id header to new_trace_id()"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"x-trace-id":
+                    if _TRACE_ID_RE.fullmatch(value):
+                        token = _REQUEST_TRACE_ID.set(value.decode("ascii"))
+                        try:
+                            await self.app(scope, receive, send)
+                        finally:
+                            _REQUEST_TRACE_ID.reset(token)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+class BodySizeLimitMiddleware:
+    """Pure-ASGI middleware answering 413 for request bodies over max_bytes.
+
+    A declared Content-Length is checked before the app runs; chunked bodies
+    are counted as the app reads them.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = -1
+                if declared < 0:
+                    response = JSONResponse({"detail": "Invalid Content-Length"}, status_code=400)
+                    await response(scope, receive, send)
+                    return
+                if declared > self.max_bytes:
+                    response = JSONResponse({"detail": "Request body too large"}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+                await self.app(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+class FastCORS:
+    """Pure-ASGI CORS middleware with header bytes precomputed at startup.
+
+    Allows any method and header for the configured origins, with credentials.
+    Preflights are answered inline; other responses only get the allow-origin
+    headers appended to their ``http.response.start`` message.
+    """
+
+    def __init__(self, app, origins: Iterable[str]):
+        self.app = app
+        self.origins = frozenset(o.encode("latin-1") for o in origins)
+        self._methods = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+        self._max_age = b"600"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = None
+        request_method = None
+        request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        allowed = origin in self.origins
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            await self._preflight(send, origin if allowed else None, request_headers)
+            return
+        if not allowed:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"access-control-allow-origin", origin),
+                    (b"access-control-allow-credentials", b"true"),
+                    (b"vary", b"Origin"),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    async def _preflight(self, send, origin: Optional[bytes], request_headers: Optional[bytes]):
+        """Answer an OPTIONS preflight without touching the app"""
+        if origin is None:
+            status_code, body = 400, b"Disallowed CORS origin"
+            headers = [(b"vary", b"Origin")]
+        else:
+            status_code, body = 200, b"OK"
+            headers = [
+                (b"access-control-allow-origin", origin),
+                (b"access-control-allow-credentials", b"true"),
+                (b"access-control-allow-methods", self._methods),
+                (b"access-control-max-age", self._max_age),
+                (b"vary", b"Origin"),
+            ]
+            if request_headers:
+                headers.append((b"access-control-allow-headers", request_headers))
+        headers.append((b"content-type", b"text/plain; charset=utf-8"))
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=CORS_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+# ============================================================================
+# App Setup
+# ============================================================================
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize the database on startup and close it on shutdown"""
+    init_db()
+    yield
+    close_db()
+
+app = FastAPI(
+    title="Plinth Backend",
+    version="1.1.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
-# Initialize database on startup
-init_db()
+# Last added runs outermost: CORS answers preflights before anything else
+# (and still decorates 413s), and GZip compresses the app's own JSON bodies
+app.add_middleware(GZipMiddleware, minimum_size=500)
+app.add_middleware(TraceIdMiddleware)
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=MAX_REQUEST_BODY_BYTES)
+app.add_middleware(FastCORS, origins=CORS_ORIGINS)
 
 # ============================================================================
 # Authentication Endpoints
 # ============================================================================
 
-@app.post("/api/v2/auth/register")
-def register(req: AuthRequest) -> AuthResponse:
+@app.post("/api/v2/auth/register", response_model=AuthResponse)
+def register(req: AuthRequest) -> Response:
     """Register a new user"""
-    db = get_db()
-    cursor = db.cursor()
-
-    # Check if user exists
-    cursor.execute("SELECT user_id FROM users WHERE email = ?", (req.email,))
-    if cursor.fetchone():
-        db.close()
-        raise HTTPException(status_code=400, detail="User already exists")
+    # Check if user exists before paying for the KDF
+    with get_db() as db:
+        if db.execute(_SQL_SELECT_USER_ID_BY_EMAIL, (req.email,)).fetchone():
+            raise HTTPException(status_code=400, detail="User already exists")
 
-    # Create user
     user_id = str(uuid4())
     password_hash = hash_password(req.password)
     now = datetime.now(timezone.utc).isoformat()
 
-    cursor.execute("""
-        INSERT INTO users (user_id, email, password_hash, created_at, onboarding_flags)
-        VALUES (?, ?, ?, ?, ?)
-    """, (user_id, req.email, password_hash, now, json.dumps({
-        "completed_questionnaire": False,
-        "selected_tone": False,
-        "reviewed_brief": False,
-    })))
-    db.commit()
-    db.close()
+    # Create user; the UNIQUE email constraint catches a concurrent sign-up
+    with get_db() as db:
+        try:
+            db.execute(_SQL_INSERT_USER, (user_id, req.email, password_hash, now, _DEFAULT_ONBOARDING_FLAGS_JSON))
+        except sqlite3.IntegrityError:
+            raise HTTPException(status_code=400, detail="User already exists")
 
     tokens = create_tokens(user_id)
-    return AuthResponse(
-        ok=True,
-        data=tokens,
-    )
+    return envelope(tokens)
 
-@app.post("/api/v2/auth/login")
-def login(req: AuthRequest) -> AuthResponse:
+@app.post("/api/v2/auth/login", response_model=AuthResponse)
+def login(req: AuthRequest) -> Response:
     """Login a user"""
-    db = get_db()
-    cursor = db.cursor()
-
-    cursor.execute("SELECT user_id, password_hash FROM users WHERE email = ?", (req.email,))
-    row = cursor.fetchone()
-    db.close()
+    with get_db() as db:
+        row = db.execute(_SQL_SELECT_USER_BY_EMAIL, (req.email,)).fetchone()
 
     if not row or not verify_password(req.password, row["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     user_id = row["user_id"]
     tokens = create_tokens(user_id)
-    return AuthResponse(
-        ok=True,
-        data=tokens,
-    )
+    return envelope(tokens)
 
 @app.get("/api/v2/auth/me")
-def get_me(user_id: str = Depends(get_current_user)):
-    """Get current user info including onboarding status"""
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT user_id, email, created_at, onboarding_data FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    db.close()
+def get_me(user_id: str = Depends(get_current_user), include: Optional[str] = Query(None)):
+    """Get current user info; the onboarding blob only with ?include=onboarding"""
+    with_onboarding = include == "onboarding"
+    sql = _SQL_SELECT_ME_WITH_ONBOARDING if with_onboarding else _SQL_SELECT_ME
+    with get_db() as db:
+        row = db.execute(sql, (user_id,)).fetchone()
 
     if not row:
         raise HTTPException(status_code=404, detail="User not found")
 
     onboarding_data = None
-    onboarding_completed = False
-    if row["onboarding_data"]:
+    if with_onboarding and row["onboarding_data"]:
         try:
             onboarding_data = json.loads(row["onboarding_data"])
-            onboarding_completed = True
         except (json.JSONDecodeError, TypeError):
             pass
 
@@ -280,154 +761,134 @@ def get_me(user_id: str = Depends(get_current_user)):
         "user_id": row["user_id"],
         "email": row["email"],
         "created_at": row["created_at"],
-        "onboarding_completed": onboarding_completed,
+        "onboarding_completed": bool(row["has_ob"]),
         "onboarding_data": onboarding_data,
     }
 
-@app.post("/api/v2/auth/refresh")
-def refresh_token(req: RefreshTokenRequest) -> AuthResponse:
+@app.post("/api/v2/auth/refresh", response_model=AuthResponse)
+async def refresh_token(req: RefreshTokenRequest) -> Response:
     """Refresh access token"""
     user_id = verify_token(req.refresh_token)
     tokens = create_tokens(user_id)
-    return AuthResponse(
-        ok=True,
-        data=tokens,
-    )
+    return envelope(tokens)
 
 # ============================================================================
 # Onboarding Endpoints
 # ============================================================================
 
-@app.post("/api/v2/onboarding/complete")
-def complete_onboarding(data: Optional[Dict[str, Any]] = None, user_id: str = Depends(get_current_user)) -> DataEnvelopeResponse:
+@app.post("/api/v2/onboarding/complete", response_model=DataEnvelopeResponse, openapi_extra=OPTIONAL_OBJECT_BODY_OPENAPI)
+def complete_onboarding(data: Optional[Dict[str, Any]] = Depends(orjson_body), user_id: str = Depends(get_current_user)) -> Response:
     """Save onboarding calibration data"""
     if not data:
         raise HTTPException(status_code=400, detail="No calibration data provided")
 
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute(
-        "UPDATE users SET onboarding_data = ?, onboarding_flags = ? WHERE user_id = ?",
-        (json.dumps(data), json.dumps({"completed_questionnaire": True, "selected_tone": True, "reviewed_brief": False}), user_id)
-    )
-    db.commit()
-    db.close()
+    # Stamped here so the voice profile can report when it actually changed
+    data["last_updated"] = utc_now_iso()
+    with get_db() as db:
+        db.execute(
+            "UPDATE users SET onboarding_data = ?, onboarding_flags = ? WHERE user_id = ?",
+            (json.dumps(data), _COMPLETED_ONBOARDING_FLAGS_JSON, user_id)
+        )
+    invalidate_user_onboarding(user_id)
 
-    return DataEnvelopeResponse(
-        ok=True,
-        data={"saved": True, "onboarding_completed": True},
-    )
+    return envelope({"saved": True, "onboarding_completed": True})
 
-@app.post("/api/v2/onboarding/questionnaire")
-def save_questionnaire(data: Optional[Dict[str, Any]] = None) -> DataEnvelopeResponse:
+@app.post("/api/v2/onboarding/questionnaire", response_model=DataEnvelopeResponse)
+async def save_questionnaire(req: QuestionnaireRequest = QuestionnaireRequest()) -> Response:
     """Save onboarding questionnaire"""
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "saved": True,
-            "questionnaire_id": str(uuid4()),
-            "topics": data.get("topics", []) if data else [],
-            "positioning": data.get("positioning", "") if data else "",
-        },
-    )
-
-@app.post("/api/v2/onboarding/tone")
-def save_tone(data: Optional[Dict[str, Any]] = None) -> DataEnvelopeResponse:
+    return envelope({
+        "saved": True,
+        "questionnaire_id": new_id(),
+        "topics": req.topics,
+        "positioning": req.positioning,
+    })
+
+@app.post("/api/v2/onboarding/tone", response_model=DataEnvelopeResponse)
+async def save_tone(req: ToneRequest = ToneRequest()) -> Response:
     """Save tone preferences"""
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "saved": True,
-            "tone_markers": data.get("tone_markers", []) if data else [],
-            "boundaries": data.get("boundaries", []) if data else [],
-        },
-    )
+    return envelope({
+        "saved": True,
+        "tone_markers": req.tone_markers,
+        "boundaries": req.boundaries,
+    })
 
 # ============================================================================
 # Session & Hub Endpoints (Personalized)
 # ============================================================================
 
-@app.get("/api/session")
-def get_session() -> SessionResponse:
+@app.get("/api/session", response_model=SessionResponse)
+async def get_session() -> Response:
     """Get session data"""
-    return SessionResponse(
-        ok=True,
-        data={
-            "user_id": str(uuid4()),
-            "email": "user@example.com",
-            "onboarding_flags": {
-                "completed_questionnaire": False,
-                "selected_tone": False,
-                "reviewed_brief": False,
-            },
-            "created_at": datetime.now(timezone.utc).isoformat(),
+    return envelope({
+        "user_id": str(uuid4()),
+        "email": "user@example.com",
+        "onboarding_flags": {
+            "completed_questionnaire": False,
+            "selected_tone": False,
+            "reviewed_brief": False,
         },
-    )
-
-@app.get("/api/hub/today")
-def get_hub_today(user_id: str = Depends(get_current_user)) -> DataEnvelopeResponse:
+        "created_at": utc_now_iso(),
+    })
+
+# Payload for users who haven't onboarded, minus the date (added per request)
+_HUB_TODAY_DEFAULT = orjson.dumps({
+    "personalized": False,
+    "brief": {
+        "topic": "Complete your brand setup",
+        "angle": "Get started",
+        "hook": "Set up your brand identity to unlock personalized strategic briefs",
+        "supporting_claims": [],
+        "rationale": "Complete onboarding to receive tailored daily briefs",
+    },
+    "strategy_snapshot": {
+        "positioning": "Not yet configured",
+        "recommended_focus": ["Complete brand setup"],
+        "active_signals": [],
+        "territory_coverage": 0,
+    },
+    "memory_state": {
+        "total_territories": 0,
+        "active_claims": 0,
+        "reinforcement_count": 0,
+    },
+    "engagement_summary": {
+        "messages_today": 0,
+        "conversations_active": 0,
+        "voice_consistency": 0,
+    },
+})
+
+@app.get("/api/hub/today", response_model=DataEnvelopeResponse)
+async def get_hub_today(user_id: str = Depends(get_current_user)) -> Response:
     """Get today's hub data — personalized if onboarding is complete"""
-    ob = get_user_onboarding(user_id)
+    ob = await load_user_onboarding(user_id)
 
     if ob:
         positioning = ob.get("positioning_target", "your expertise")
-        topics = ob.get("content_territories", ob.get("core_ideas", []))
+        core_ideas = ob.get("core_ideas", [])
+        topics = ob.get("content_territories", core_ideas)
         audience = ob.get("audience_description", "your audience")
+        topic_count = len(topics) if topics else 0
         first_topic = topics[0] if topics else "your core topic"
-        second_topic = topics[1] if len(topics) > 1 else "your expertise"
-        return DataEnvelopeResponse(
-            ok=True,
-            data={
-                "date": datetime.now(timezone.utc).date().isoformat(),
-                "personalized": True,
-                "brief": {
-                    "topic": first_topic,
-                    "angle": f"Reinforce your positioning in {positioning}",
-                    "hook": f"Share your perspective on {first_topic} — your audience needs this from you today",
-                    "supporting_claims": ob.get("core_ideas", [])[:3],
-                    "rationale": f"This reinforces your authority in {positioning} for {audience}",
-                },
-                "strategy_snapshot": {
-                    "positioning": positioning,
-                    "recommended_focus": topics[:3] if topics else ["Define your territories"],
-                    "active_signals": [f"Reinforce {t}" for t in (topics[:2] if topics else ["your positioning"])],
-                    "territory_coverage": min(len(topics) * 15, 100) if topics else 0,
-                },
-                "memory_state": {
-                    "total_territories": len(topics) if topics else 0,
-                    "active_claims": len(ob.get("core_ideas", [])),
-                    "reinforcement_count": 0,
-                },
-                "engagement_summary": {
-                    "messages_today": 0,
-                    "conversations_active": 0,
-                    "voice_consistency": 0,
-                },
-            },
-        )
-
-    # Default for users who haven't onboarded
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "date": datetime.now(timezone.utc).date().isoformat(),
-            "personalized": False,
+        return envelope({
+            "date": utc_today_iso(),
+            "personalized": True,
             "brief": {
-                "topic": "Complete your brand setup",
-                "angle": "Get started",
-                "hook": "Set up your brand identity to unlock personalized strategic briefs",
-                "supporting_claims": [],
-                "rationale": "Complete onboarding to receive tailored daily briefs",
+                "topic": first_topic,
+                "angle": f"Reinforce your positioning in {positioning}",
+                "hook": f"Share your perspective on {first_topic} — your audience needs this from you today",
+                "supporting_claims": core_ideas[:3],
+                "rationale": f"This reinforces your authority in {positioning} for {audience}",
             },
             "strategy_snapshot": {
-                "positioning": "Not yet configured",
-                "recommended_focus": ["Complete brand setup"],
-                "active_signals": [],
-                "territory_coverage": 0,
+                "positioning": positioning,
+                "recommended_focus": topics[:3] if topics else ["Define your territories"],
+                "active_signals": [f"Reinforce {t}" for t in (islice(topics, 2) if topics else ["your positioning"])],
+                "territory_coverage": min(topic_count * 15, 100),
             },
             "memory_state": {
-                "total_territories": 0,
-                "active_claims": 0,
+                "total_territories": topic_count,
+                "active_claims": len(core_ideas),
                 "reinforcement_count": 0,
             },
             "engagement_summary": {
@@ -435,314 +896,389 @@ def get_hub_today(user_id: str = Depends(get_current_user)) -> DataEnvelopeRespo
                 "conversations_active": 0,
                 "voice_consistency": 0,
             },
-        },
-    )
+        })
 
-@app.get("/api/hub/brief")
-def get_brief(user_id: str = Depends(get_current_user)) -> DataEnvelopeResponse:
+    # Default for users who haven't onboarded
+    return raw_envelope(with_fields(_HUB_TODAY_DEFAULT, date=utc_today_iso()))
+
+# Personalized payload shape; values are encoded and spliced in per request
+_BRIEF_TEMPLATE = (
+    b'{"topic":%b,"subtopic":%b,"angle":%b,"hook":%b,"supporting_claims":%b,'
+    b'"rationale":%b,"key_messages":%b,"created_at":%b,"expires_at":%b}'
+)
+
+# Payload for users who haven't onboarded, minus timestamps (added per request)
+_BRIEF_DEFAULT = orjson.dumps({
+    "topic": "Set up your brand",
+    "subtopic": "Getting started",
+    "angle": "Complete onboarding",
+    "hook": "Configure your brand identity to unlock personalized briefs",
+    "supporting_claims": [],
+    "rationale": "Complete the brand setup to receive strategic daily briefs",
+    "key_messages": ["Complete your brand setup to get started"],
+})
+
+@app.get("/api/hub/brief", response_model=DataEnvelopeResponse)
+async def get_brief(user_id: str = Depends(get_current_user)) -> Response:
     """Get brief data — personalized"""
-    ob = get_user_onboarding(user_id)
+    ob = await load_user_onboarding(user_id)
 
     if ob:
         positioning = ob.get("positioning_target", "your expertise")
-        topics = ob.get("content_territories", ob.get("core_ideas", []))
+        core_ideas = ob.get("core_ideas", [])
+        topics = ob.get("content_territories", core_ideas)
         first_topic = topics[0] if topics else positioning
-        return DataEnvelopeResponse(
-            ok=True,
-            data={
-                "topic": first_topic,
-                "subtopic": positioning,
-                "angle": f"Strengthen your authority in {first_topic}",
-                "hook": f"Share your unique perspective on {first_topic} to reinforce your positioning",
-                "supporting_claims": ob.get("core_ideas", []),
-                "rationale": f"Publishing on {first_topic} reinforces your positioning in {positioning}",
-                "key_messages": ob.get("core_ideas", [])[:3],
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
-            },
-        )
-
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "topic": "Set up your brand",
-            "subtopic": "Getting started",
-            "angle": "Complete onboarding",
-            "hook": "Configure your brand identity to unlock personalized briefs",
-            "supporting_claims": [],
-            "rationale": "Complete the brand setup to receive strategic daily briefs",
-            "key_messages": ["Complete your brand setup to get started"],
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
-        },
-    )
+        return raw_envelope(fill_template(
+            _BRIEF_TEMPLATE,
+            first_topic,
+            positioning,
+            f"Strengthen your authority in {first_topic}",
+            f"Share your unique perspective on {first_topic} to reinforce your positioning",
+            core_ideas,
+            f"Publishing on {first_topic} reinforces your positioning in {positioning}",
+            core_ideas[:3],
+            utc_now_iso(),
+            utc_now_iso(BRIEF_EXPIRY_SECONDS),
+        ))
+
+    return raw_envelope(with_fields(
+        _BRIEF_DEFAULT,
+        created_at=utc_now_iso(),
+        expires_at=utc_now_iso(BRIEF_EXPIRY_SECONDS),
+    ))
 
 # ============================================================================
 # Memory Endpoints (Personalized)
 # ============================================================================
 
-@app.get("/api/v2/memory/state")
-def get_memory_state(user_id: str = Depends(get_current_user)) -> DataEnvelopeResponse:
+# Payloads for users who haven't onboarded, encoded once at import
+
+_MEMORY_STATE_DEFAULT = orjson.dumps({
+    "territories": [],
+    "total_territories": 0,
+    "total_claims": 0,
+    "total_reinforcements": 0,
+})
+
+@app.get("/api/v2/memory/state", response_model=DataEnvelopeResponse)
+async def get_memory_state(user_id: str = Depends(get_current_user)) -> Response:
     """Get memory state — personalized"""
-    ob = get_user_onboarding(user_id)
+    ob = await load_user_onboarding(user_id)
 
     if ob:
         topics = ob.get("content_territories", ob.get("core_ideas", []))
         territories = []
-        for i, t in enumerate(topics[:6]):
+        for i, t in enumerate(islice(topics, 6)):
             territories.append({
                 "id": f"t{i+1}",
                 "name": t,
                 "claims_count": 0,
                 "reinforcement_score": 0,
             })
-        return DataEnvelopeResponse(
-            ok=True,
-            data={
-                "territories": territories,
-                "total_territories": len(territories),
-                "total_claims": len(ob.get("core_ideas", [])),
-                "total_reinforcements": 0,
-            },
-        )
-
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "territories": [],
-            "total_territories": 0,
-            "total_claims": 0,
+        return envelope({
+            "territories": territories,
+            "total_territories": len(territories),
+            "total_claims": len(ob.get("core_ideas", [])),
             "total_reinforcements": 0,
-        },
-    )
+        })
+
+    return raw_envelope(_MEMORY_STATE_DEFAULT)
+
+_REINFORCEMENT_COUNTS_DEFAULT = orjson.dumps({
+    "weekly": 0,
+    "monthly": 0,
+    "all_time": 0,
+    "by_territory": {},
+})
 
-@app.get("/api/v2/memory/reinforcement/counts")
-def get_reinforcement_counts(user_id: str = Depends(get_current_user)) -> DataEnvelopeResponse:
+@app.get("/api/v2/memory/reinforcement/counts", response_model=DataEnvelopeResponse)
+async def get_reinforcement_counts(user_id: str = Depends(get_current_user)) -> Response:
     """Get reinforcement counts"""
-    ob = get_user_onboarding(user_id)
-    by_territory = {}
-    if ob:
-        for t in ob.get("content_territories", [])[:6]:
-            by_territory[t] = 0
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "weekly": 0,
-            "monthly": 0,
-            "all_time": 0,
-            "by_territory": by_territory,
-        },
-    )
+    ob = await load_user_onboarding(user_id)
+    if not ob:
+        return raw_envelope(_REINFORCEMENT_COUNTS_DEFAULT)
 
-@app.get("/api/v2/memory/territory/coverage")
-def get_territory_coverage(user_id: str = Depends(get_current_user)) -> DataEnvelopeResponse:
+    by_territory = {}
+    for t in islice(ob.get("content_territories", []), 6):
+        by_territory[t] = 0
+    return envelope({
+        "weekly": 0,
+        "monthly": 0,
+        "all_time": 0,
+        "by_territory": by_territory,
+    })
+
+_TERRITORY_COVERAGE_DEFAULT = orjson.dumps({
+    "coverage_percentage": 0,
+    "territories": [],
+})
+
+@app.get("/api/v2/memory/territory/coverage", response_model=DataEnvelopeResponse)
+async def get_territory_coverage(user_id: str = Depends(get_current_user)) -> Response:
     """Get territory coverage"""
-    ob = get_user_onboarding(user_id)
+    ob = await load_user_onboarding(user_id)
+    if not ob:
+        return raw_envelope(_TERRITORY_COVERAGE_DEFAULT)
+
     territories = []
-    if ob:
-        for t in ob.get("content_territories", [])[:6]:
-            territories.append({
-                "name": t,
-                "coverage": 0,
-                "last_reinforced": None,
-            })
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "coverage_percentage": 0,
-            "territories": territories,
-        },
-    )
+    for t in islice(ob.get("content_territories", []), 6):
+        territories.append({
+            "name": t,
+            "coverage": 0,
+            "last_reinforced": None,
+        })
+    return envelope({
+        "coverage_percentage": 0,
+        "territories": territories,
+    })
 
 # ============================================================================
 # Strategy Endpoints (Personalized)
 # ============================================================================
 
-@app.get("/api/v2/strategy")
-def get_strategy(user_id: str = Depends(get_current_user)) -> DataEnvelopeResponse:
+# Personalized payload shape; values are encoded and spliced in per request
+_STRATEGY_TEMPLATE = (
+    b'{"positioning":%b,"target_audience":%b,"recommended_focus":%b,"active_signals":%b,'
+    b'"territory_allocation":%b,"messaging_pillars":%b,"created_at":%b}'
+)
+
+# Payload for users who haven't onboarded, minus created_at (added per request)
+_STRATEGY_DEFAULT = orjson.dumps({
+    "positioning": "Not yet configured",
+    "target_audience": "Complete brand setup",
+    "recommended_focus": [],
+    "active_signals": [],
+    "territory_allocation": {},
+    "messaging_pillars": [],
+})
+
+@app.get("/api/v2/strategy", response_model=DataEnvelopeResponse)
+async def get_strategy(user_id: str = Depends(get_current_user)) -> Response:
     """Get strategy data — personalized"""
-    ob = get_user_onboarding(user_id)
+    ob = await load_user_onboarding(user_id)
 
     if ob:
         positioning = ob.get("positioning_target", "your expertise")
         audience = ob.get("audience_description", "your audience")
         topics = ob.get("content_territories", [])
         core_ideas = ob.get("core_ideas", [])
-        return DataEnvelopeResponse(
-            ok=True,
-            data={
-                "positioning": positioning,
-                "target_audience": audience,
-                "recommended_focus": topics[:3] if topics else [],
-                "active_signals": [f"Reinforce: {c}" for c in core_ideas[:4]],
-                "territory_allocation": {t: round(100 / max(len(topics), 1)) for t in topics[:5]},
-                "messaging_pillars": core_ideas[:3],
-                "created_at": datetime.now(timezone.utc).isoformat(),
-            },
-        )
-
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "positioning": "Not yet configured",
-            "target_audience": "Complete brand setup",
-            "recommended_focus": [],
-            "active_signals": [],
-            "territory_allocation": {},
-            "messaging_pillars": [],
-            "created_at": datetime.now(timezone.utc).isoformat(),
-        },
-    )
+        share = round(100 / max(len(topics), 1))
+        return raw_envelope(fill_template(
+            _STRATEGY_TEMPLATE,
+            positioning,
+            audience,
+            topics[:3],
+            [f"Reinforce: {c}" for c in islice(core_ideas, 4)],
+            dict.fromkeys(islice(topics, 5), share),
+            core_ideas[:3],
+            utc_now_iso(),
+        ))
+
+    return raw_envelope(with_fields(_STRATEGY_DEFAULT, created_at=utc_now_iso()))
 
 # ============================================================================
 # Chat Endpoints
 # ============================================================================
 
-@app.post("/api/v2/chat/context")
-def get_chat_context(data: Optional[Dict[str, Any]] = None) -> DataEnvelopeResponse:
+_CHAT_CONTEXT = orjson.dumps({
+    "current_brief": {"topic": "Your brand strategy", "angle": "Personalized"},
+    "recent_territories": [],
+    "message_history_count": 0,
+    "conversation_context": "Strategic coaching session",
+})
+
+@app.post("/api/v2/chat/context", response_model=DataEnvelopeResponse, openapi_extra=OPTIONAL_OBJECT_BODY_OPENAPI)
+async def get_chat_context(data: Optional[Dict[str, Any]] = Depends(orjson_body)) -> Response:
     """Get chat context"""
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "current_brief": {"topic": "Your brand strategy", "angle": "Personalized"},
-            "recent_territories": [],
-            "message_history_count": 0,
-            "conversation_context": "Strategic coaching session",
-        },
-    )
+    return raw_envelope(_CHAT_CONTEXT)
+
+# Intent keywords, found in a single scan of the lowercased message (str.lower,
+# not re.IGNORECASE, whose case folding matches e.g. 'ſtrategy'); the handler
+# checks them in priority order brief > memory/reinforce > strategy
+_INTENT_RE = re.compile(r"brief|memory|reinforce|strategy")
+
+def _coach_reply(ob: Dict[str, Any], intent: str) -> str:
+    """Render the coach reply for one intent from onboarding data"""
+    positioning = ob.get("positioning_target", "your expertise")
+    if intent == "brief":
+        return f"Your current focus is on reinforcing your positioning in {positioning}. Would you like to explore specific angles?"
+    if intent == "memory":
+        topics = ob.get("content_territories", [])
+        core_ideas = ob.get("core_ideas", [])
+        return f"You have {len(topics)} territories and {len(core_ideas)} core ideas configured. Let's plan your reinforcement strategy."
+    if intent == "strategy":
+        return f"Your positioning as an authority in {positioning} is your strategic foundation. Which territory would you like to strengthen first?"
+    topics = ob.get("content_territories", [])
+    topic_list = ", ".join(islice(topics, 3)) if topics else "your key topics"
+    return f"I'm here to help you build authority in {positioning}. Your territories include {topic_list}. What would you like to work on?"
+
+# Reply payload shape; message and context are encoded and spliced in per request
+_COACH_REPLY_TEMPLATE = (
+    b'{"message":%b,'
+    b'"suggestions":["Review your brief","Check memory coverage","Refine strategy focus"],'
+    b'"context":%b}'
+)
+_COACH_WELCOME_TEXT = "Welcome to Plinth! Complete your brand setup first to unlock personalized coaching. Head to Setup to configure your brand identity."
+# Full reply for users who haven't onboarded and sent no context
+_COACH_WELCOME = fill_template(_COACH_REPLY_TEMPLATE, _COACH_WELCOME_TEXT, {})
 
-@app.post("/api/coach/chat")
-def coach_chat(req: ChatRequest, user_id: str = Depends(get_current_user)) -> DataEnvelopeResponse:
+@app.post("/api/coach/chat", response_model=DataEnvelopeResponse)
+async def coach_chat(req: ChatRequest, user_id: str = Depends(get_current_user)) -> Response:
     """Chat with coach — personalized"""
-    ob = get_user_onboarding(user_id)
-    message = req.message.lower()
+    ob = await load_user_onboarding(user_id)
+    if not ob and not req.context:
+        return raw_envelope(_COACH_WELCOME)
 
     if ob:
-        positioning = ob.get("positioning_target", "your expertise")
-        topics = ob.get("content_territories", [])
-        core_ideas = ob.get("core_ideas", [])
-
-        if "brief" in message:
-            response_text = f"Your current focus is on reinforcing your positioning in {positioning}. Would you like to explore specific angles?"
-        elif "memory" in message or "reinforce" in message:
-            response_text = f"You have {len(topics)} territories and {len(core_ideas)} core ideas configured. Let's plan your reinforcement strategy."
-        elif "strategy" in message:
-            response_text = f"Your positioning as an authority in {positioning} is your strategic foundation. Which territory would you like to strengthen first?"
+        intents = set(_INTENT_RE.findall(req.message.lower()))
+        if "brief" in intents:
+            intent = "brief"
+        elif "memory" in intents or "reinforce" in intents:
+            intent = "memory"
+        elif "strategy" in intents:
+            intent = "strategy"
         else:
-            topic_list = ", ".join(topics[:3]) if topics else "your key topics"
-            response_text = f"I'm here to help you build authority in {positioning}. Your territories include {topic_list}. What would you like to work on?"
+            intent = "default"
+        response_text = cached_render(user_id, ob, "coach:" + intent, lambda: _coach_reply(ob, intent))
     else:
-        response_text = "Welcome to Plinth! Complete your brand setup first to unlock personalized coaching. Head to Setup to configure your brand identity."
-
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "message": response_text,
-            "suggestions": ["Review your brief", "Check memory coverage", "Refine strategy focus"],
-            "context": req.context or {},
-        },
-    )
+        response_text = _COACH_WELCOME_TEXT
+
+    return raw_envelope(fill_template(_COACH_REPLY_TEMPLATE, response_text, req.context or {}))
 
 # ============================================================================
 # Voice Endpoints
 # ============================================================================
 
-@app.get("/api/v2/voice/profile")
-def get_voice_profile(user_id: str = Depends(get_current_user)) -> DataEnvelopeResponse:
-    """Get voice profile — personalized"""
-    ob = get_user_onboarding(user_id)
-
-    if ob:
-        voice_style = ob.get("voice_style", "Professional")
-        return DataEnvelopeResponse(
-            ok=True,
-            data={
-                "tone_markers": [voice_style, "Authentic", "Strategic"],
-                "boundaries": ob.get("integrity_boundaries", {}).get("values_protect", []),
-                "examples": [],
-                "consistency_score": 0,
-                "consistency_trend": "new",
-                "last_updated": datetime.now(timezone.utc).isoformat(),
-            },
-        )
-
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "tone_markers": [],
-            "boundaries": [],
-            "examples": [],
-            "consistency_score": 0,
-            "consistency_trend": "new",
-            "last_updated": datetime.now(timezone.utc).isoformat(),
-        },
-    )
+# Payload for users who haven't onboarded, minus last_updated (added per request)
+_VOICE_PROFILE_DEFAULT = orjson.dumps({
+    "tone_markers": [],
+    "boundaries": [],
+    "examples": [],
+    "consistency_score": 0,
+    "consistency_trend": "new",
+})
+# Ignores last_updated, which carries no information before onboarding
+_VOICE_PROFILE_DEFAULT_ETAG = etag_for(_VOICE_PROFILE_DEFAULT)
+
+def voice_profile_json(ob: Optional[Dict[str, Any]]) -> bytes:
+    """Encoded voice profile data for a user's onboarding record (or None)"""
+    if not ob:
+        return with_fields(_VOICE_PROFILE_DEFAULT, last_updated=utc_now_iso())
+    voice_style = ob.get("voice_style", "Professional")
+    return dumps_json({
+        "tone_markers": [voice_style, "Authentic", "Strategic"],
+        "boundaries": ob.get("integrity_boundaries", {}).get("values_protect", []),
+        "examples": [],
+        "consistency_score": 0,
+        "consistency_trend": "new",
+        "last_updated": ob.get("last_updated") or utc_now_iso(),
+    })
+
+@app.get("/api/v2/voice/profile", response_model=DataEnvelopeResponse)
+async def get_voice_profile(request: Request, user_id: str = Depends(get_current_user)) -> Response:
+    """Get voice profile — personalized, with ETag revalidation"""
+    ob = await load_user_onboarding(user_id)
+    data_json = voice_profile_json(ob)
+    etag = etag_for(data_json) if ob else _VOICE_PROFILE_DEFAULT_ETAG
+    return conditional_envelope(request, data_json, etag)
 
 # ============================================================================
 # Draft Endpoints
 # ============================================================================
 
-@app.post("/api/v2/drafts/generate")
-def generate_draft(data: Optional[Dict[str, Any]] = None, user_id: str = Depends(get_current_user)) -> DataEnvelopeResponse:
-    """Generate a draft — personalized"""
-    ob = get_user_onboarding(user_id)
+# Payload for users who haven't onboarded, minus draft_id/created_at (added per request)
+_DRAFT_DEFAULT = orjson.dumps({
+    "type": "article",
+    "title": "Draft: Set up your brand",
+    "content": "Complete your brand setup to generate personalized drafts.",
+    "territories_covered": [],
+    "tone_alignment": 0,
+})
+
+# Personalized payload shape; values are encoded and spliced in per request
+_DRAFT_TEMPLATE = (
+    b'{"draft_id":%b,"type":"article","title":%b,"content":%b,'
+    b'"territories_covered":%b,"tone_alignment":0,"created_at":%b}'
+)
 
-    if ob:
-        positioning = ob.get("positioning_target", "your expertise")
-        topics = ob.get("content_territories", ob.get("core_ideas", []))
-        first_topic = topics[0] if topics else positioning
-        core_ideas = ob.get("core_ideas", [])
-        claims_text = "\n\n".join([f"- {c}" for c in core_ideas[:3]]) if core_ideas else ""
+def _draft_content(ob: Dict[str, Any]) -> str:
+    """Render the structural draft body from onboarding data"""
+    positioning = ob.get("positioning_target", "your expertise")
+    topics = ob.get("content_territories", ob.get("core_ideas", []))
+    first_topic = topics[0] if topics else positioning
+    core_ideas = ob.get("core_ideas", [])
+    claims_text = "\n\n".join(f"- {c}" for c in islice(core_ideas, 3)) if core_ideas else ""
 
-        content = f"""Here's a draft focused on {first_topic} to reinforce your positioning in {positioning}.
+    return f"""Here's a draft focused on {first_topic} to reinforce your positioning in {positioning}.
 
 Your key messages to reinforce:
 {claims_text}
 
 [This is a structural draft. Connect your personal experience and insights to these core ideas to make it authentic and compelling.]"""
-    else:
-        content = "Complete your brand setup to generate personalized drafts."
-
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "draft_id": str(uuid4()),
-            "type": "article",
-            "title": f"Draft: {ob.get('positioning_target', 'Your Topic') if ob else 'Set up your brand'}",
-            "content": content,
-            "territories_covered": ob.get("content_territories", [])[:3] if ob else [],
-            "tone_alignment": 0,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-        },
+
+def draft_json(user_id: str, ob: Optional[Dict[str, Any]]) -> bytes:
+    """Encoded new draft data for a user's onboarding record (or None)"""
+    if not ob:
+        return with_fields(_DRAFT_DEFAULT, draft_id=new_id(), created_at=utc_now_iso())
+    return fill_template(
+        _DRAFT_TEMPLATE,
+        new_id(),
+        f"Draft: {ob.get('positioning_target', 'Your Topic')}",
+        cached_render(user_id, ob, "draft", lambda: _draft_content(ob)),
+        ob.get("content_territories", [])[:3],
+        utc_now_iso(),
     )
 
-@app.post("/api/v2/drafts/validate")
-def validate_draft(data: Optional[Dict[str, Any]] = None) -> DataEnvelopeResponse:
+@app.post("/api/v2/drafts/generate", response_model=DataEnvelopeResponse, openapi_extra=OPTIONAL_OBJECT_BODY_OPENAPI)
+async def generate_draft(data: Optional[Dict[str, Any]] = Depends(orjson_body), user_id: str = Depends(get_current_user)) -> Response:
+    """Generate a draft — personalized"""
+    ob = await load_user_onboarding(user_id)
+    return raw_envelope(draft_json(user_id, ob))
+
+_VALIDATE_DRAFT_RESULT = orjson.dumps({
+    "is_valid": True,
+    "tone_alignment_score": 0,
+    "brief_alignment_score": 0,
+    "territory_coverage_score": 0,
+    "issues": [],
+    "suggestions": ["Continue building your content library"],
+})
+
+@app.post("/api/v2/drafts/validate", response_model=DataEnvelopeResponse, openapi_extra=OPTIONAL_OBJECT_BODY_OPENAPI)
+async def validate_draft(data: Optional[Dict[str, Any]] = Depends(orjson_body)) -> Response:
     """Validate a draft"""
-    return DataEnvelopeResponse(
-        ok=True,
-        data={
-            "is_valid": True,
-            "tone_alignment_score": 0,
-            "brief_alignment_score": 0,
-            "territory_coverage_score": 0,
-            "issues": [],
-            "suggestions": ["Continue building your content library"],
-        },
-    )
+    return raw_envelope(_VALIDATE_DRAFT_RESULT)
+
+# ============================================================================
+# Session Bootstrap
+# ============================================================================
+
+_BOOTSTRAP_TEMPLATE = b'{"voice_profile":%b,"chat_context":%b,"draft":%b}'
+
+@app.get("/api/v2/session/bootstrap", response_model=DataEnvelopeResponse)
+async def session_bootstrap(user_id: str = Depends(get_current_user)) -> Response:
+    """Voice profile, chat context and an initial draft from one onboarding read"""
+    ob = await load_user_onboarding(user_id)
+    return raw_envelope(_BOOTSTRAP_TEMPLATE % (voice_profile_json(ob), _CHAT_CONTEXT, draft_json(user_id, ob)))
 
 # ============================================================================
 # Health Check
 # ============================================================================
 
+_HEALTH_BYTES = orjson.dumps({"status": "healthy"})
+
 @app.get("/health")
-def health_check() -> Dict[str, str]:
-    """Health check endpoint"""
-    return {"status": "healthy"}
+async def health_check() -> Response:
+    """Health check endpoint (body is encoded once at import)"""
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
 
 # ============================================================================
 # Main
 # ============================================================================
 
+# Local single-process run. In production (Dockerfile/Procfile) the app is served by
+#   gunicorn main:app -k uvicorn_worker.UvicornWorker --bind 0.0.0.0:8000
+# with WEB_CONCURRENCY workers; each worker opens its own DB connection in
+# lifespan and keeps its own caches.
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools", access_log=False)